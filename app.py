@@ -1,17 +1,85 @@
-from flask import Flask, request, render_template, jsonify # ADDED render_template
+from flask import Flask, request, render_template, jsonify, url_for, Response, make_response # ADDED render_template
 # The output is no longer guaranteed to be clean text, so we'll adjust the import 
 # to just pull the necessary components
-from gemini_market_agent import GeminiAgent, SYSTEM_PROMPT, GEMINI_API_KEY, GOOGLE_API_KEY, GOOGLE_CX 
+from gemini_market_agent import GeminiAgent, SYSTEM_PROMPT, GEMINI_API_KEY, GOOGLE_API_KEY, GOOGLE_CX, BATCH_MAX_QUERIES, is_error_response
 import os
+import re
+import json
+import hashlib
+import threading
+from jinja2 import FileSystemBytecodeCache
 
 app = Flask(__name__)
 
+# Templates are parsed once and their compiled bytecode is reused across workers and restarts
+JINJA_CACHE_DIR = ".jinja_cache"
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.auto_reload = False
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Markdown/quote scrub applied to the model output: one regex pass for the characters, then the
+# newline collapse, which must run after star removal so lines that held only "**" collapse too.
+_SCRUB = re.compile(r"\*+|’")
+_SCRUB_MAP = {"’": "'"}
+
+
+# --- FINAL MAX-SAFETY CLEANING, applied in the template as {{ analysis | scrub }} ---
+# 1. Remove ALL Markdown characters that could cause HTML/Jinja syntax issues.
+# 2. Replace the HTML-unsafe single quote (’) with a safe quote.
+# 3. Aggressively ensure multiple newlines don't confuse the parser.
+def _strip_md(text: str) -> str:
+    return _SCRUB.sub(lambda m: _SCRUB_MAP.get(m.group(0), ""), text or "")
+
+
+def _collapse_newlines(text: str) -> str:
+    return text.replace('\n\n', '\n')
+
+
+@app.template_filter('scrub')
+def scrub_md(text: str) -> str:
+    return _collapse_newlines(_strip_md(text))
+
+# Shared query-string parsing for the /analyze family of routes
+DEFAULT_QUERY = 'Ghost Kitchen Market US Strategy'
+_TRUTHY = frozenset({'true', 't', '1', 'yes', 'y'})
+
+
+def _flag(req, name: str) -> bool:
+    return (req.args.get(name) or '').lower() in _TRUTHY
+
+
+def _parse_analyze_args(req):
+    # Returns (query, search_used)
+    return req.args.get('q', DEFAULT_QUERY), not _flag(req, 'no-search')
+
 # Initialize the agent (keep this block the same)
 try:
     AGENT = GeminiAgent(GEMINI_API_KEY, SYSTEM_PROMPT)
 except ValueError as e:
     AGENT = None
     print(f"Agent initialization failed: {e}")
+
+# Popular queries to pre-analyze at startup, e.g. WARMUP_QUERIES="NVIDIA stock,Apple,Tesla"
+WARMUP_QUERIES = [q.strip() for q in os.environ.get("WARMUP_QUERIES", "").split(",") if q.strip()]
+
+
+def _warm_up(queries):
+    AGENT.prefetch_searches(queries, use_search=True)
+    for q in queries:
+        try:
+            AGENT.ask_market(q, use_search=True)
+        except Exception as e:
+            print(f"-> WARNING: Warm-up failed for '{q}': {e}")
+    print(f"-> Warm-up finished for {len(queries)} queries.")
+
+
+def start_warmup():
+    # Runs in the background so the server starts answering immediately
+    if not AGENT or not WARMUP_QUERIES:
+        return None
+    thread = threading.Thread(target=_warm_up, args=(WARMUP_QUERIES,), name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
     
     # NEW: The root path now serves the input form
 @app.route('/', methods=['GET'])
@@ -20,34 +88,96 @@ def index():
 
 # Change the output to HTML
 @app.route('/analyze', methods=['GET'])
-def analyze():
+async def analyze():
     if not AGENT:
         return f"<h1>Error: Agent not initialized. Check server environment variables.</h1>", 500
         
-    query = request.args.get('q', 'Ghost Kitchen Market US Strategy')
-    search_used = request.args.get('no-search', 'false').lower() not in ('true', 't', '1') 
-    
-    analysis_output = AGENT.ask_market(query, use_search=search_used) 
+    query, search_used = _parse_analyze_args(request)
 
-    # --- FINAL MAX-SAFETY CLEANING ---
-    # 1. Remove ALL Markdown characters that could cause HTML/Jinja syntax issues.
-    analysis_output = analysis_output.replace('**', '').replace('*', '')
-    
-    # 2. Replace the HTML-unsafe single quote (') with a safe quote (or remove it)
-    analysis_output = analysis_output.replace("’", "'") 
+    # ?stream=1 renders the page shell right away; the report streams in from /analyze_stream
+    if _flag(request, 'stream'):
+        stream_args = {'q': query} if search_used else {'q': query, 'no-search': 'true'}
+        return render_template(
+            'analyze.html',
+            query=query,
+            search_used=search_used,
+            stream_url=url_for('analyze_stream', **stream_args)
+        )
     
-    # 3. Aggressively ensure multiple newlines don't confuse the parser
-    analysis_output = analysis_output.replace('\n\n', '\n')
-    # -----------------------------------
+    analysis_output = await AGENT.ask_market_async(query, use_search=search_used)
+
+    # Error messages are never cached by the browser. Otherwise the ETag covers the analysis itself, so a
+    # repeat load of an unchanged (usually response-cached) report gets a bodiless 304 without re-rendering.
+    if is_error_response(analysis_output):
+        etag = None
+    else:
+        etag = hashlib.blake2b(f"{query}|{search_used}|{analysis_output}".encode("utf-8"), digest_size=8).hexdigest()
+
+    if etag and etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render_template(
+            'analyze.html',
+            query=query,
+            search_used=search_used, 
+            analysis=analysis_output
+        ))
+
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=300'
+    else:
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Server-sent events: one "data:" event per scrubbed chunk (JSON-encoded string), then a "done" event.
+# Trailing newlines of each chunk are held back and prepended to the next one before the newline
+# collapse, so a "\n\n" split across chunks is scrubbed exactly as on the buffered /analyze page.
+@app.route('/analyze_stream', methods=['GET'])
+def analyze_stream():
+    if not AGENT:
+        return "Error: Agent not initialized. Check server environment variables.", 500
+
+    query, search_used = _parse_analyze_args(request)
+
+    def events():
+        carry = ""
+        for chunk in AGENT.ask_market_stream(query, use_search=search_used):
+            text = carry + _strip_md(chunk)
+            body = text.rstrip('\n')
+            carry = text[len(body):]
+            if body:
+                yield f"data: {json.dumps(_collapse_newlines(body))}\n\n"
+        if carry:
+            yield f"data: {json.dumps(_collapse_newlines(carry))}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Several queries in one call, e.g. /analyze_batch?qs=NVIDIA,AMD,Intel
+# -> JSON {"search_used": ..., "results": [{"query": ..., "analysis": ...}, ...]} in request order
+@app.route('/analyze_batch', methods=['GET'])
+def analyze_batch():
+    if not AGENT:
+        return jsonify({"error": "Agent not initialized. Check server environment variables."}), 500
+
+    queries = list(dict.fromkeys(q.strip() for q in request.args.get('qs', '').split(',') if q.strip()))
+    if not queries:
+        return jsonify({"error": "Pass one or more comma-separated queries in 'qs'."}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch."}), 400
+    search_used = not _flag(request, 'no-search')
 
-    return render_template(
-        'analyze.html',
-        query=query,
-        search_used=search_used, 
-        analysis=analysis_output
-    )
+    results = AGENT.ask_market_many(queries, use_search=search_used)
+    return jsonify({"search_used": search_used, "results": results})
 
 if __name__ == '__main__':
     # You can now run this locally with 'flask run' or 'python app.py'
     # and visit http://127.0.0.1:5000/analyze
-    app.run(debug=True)
\ No newline at end of file
+    # In production serve it with Gunicorn instead: gunicorn -c gunicorn.conf.py app:app
+    debug = os.environ.get("FLASK_ENV") == "development"
+    # With the reloader on, only the serving child process (not the file watcher) warms the caches
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warmup()
+    app.run(debug=debug)
\ No newline at end of file
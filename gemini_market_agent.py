@@ -1,10 +1,19 @@
 import os
 import time
+import asyncio
 import json
 import hashlib
-from typing import List, Dict, Optional
+import functools
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator, Tuple
+import numpy as np
+import orjson
 import requests
-import google.generativeai as genai
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # ---------- Config (set env vars or paste direct for prototyping) ----------
@@ -13,34 +22,217 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
 GOOGLE_CX = os.environ.get("GOOGLE_CX", "")
 SEARCH_RESULTS = 6  # number of search results to fetch
+DEBUG_RAW = os.environ.get("DEBUG_RAW") == "1"  # keep the full CSE item in the search cache for debugging
+MAX_OUTPUT_TOKENS = 4048  # per analysis
+BATCH_MAX_WORKERS = 8  # concurrent CSE requests per batch
+BATCH_MAX_QUERIES = 10  # queries fused into one Gemini request
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)  # lifetime of the server-side cached system prompt
+CONTEXT_CACHE_RETRY = 600  # seconds to wait before retrying a failed context-cache creation
 
 # ---------- Simple file-cache helper to avoid repeated searches during development ----------
 CACHE_DIR = ".search_cache"
+SEARCH_CACHE_TTL = 3600  # seconds a cached search result stays fresh
 os.makedirs(CACHE_DIR, exist_ok=True)
 
 
 def _cache_key(q: str) -> str:
-    h = hashlib.sha1(q.encode("utf-8")).hexdigest()
+    h = hashlib.blake2b(q.encode("utf-8"), digest_size=16).hexdigest()
     return os.path.join(CACHE_DIR, f"{h}.json")
 
 
+# In-process LRU in front of the file cache: q -> (stored_at, data). Shared by all threads of a worker.
+MEM_CACHE_SIZE = 256
+_MEM: "OrderedDict[str, tuple]" = OrderedDict()
+_MEM_LOCK = threading.Lock()
+
+
+def _mem_put(q: str, stored_at: float, data: Dict):
+    with _MEM_LOCK:
+        _MEM[q] = (stored_at, data)
+        _MEM.move_to_end(q)
+        if len(_MEM) > MEM_CACHE_SIZE:
+            _MEM.popitem(last=False)
+
+
 def cache_get(q: str) -> Optional[Dict]:
+    now = time.time()
+    with _MEM_LOCK:
+        hit = _MEM.get(q)
+        if hit:
+            if now - hit[0] < SEARCH_CACHE_TTL:
+                _MEM.move_to_end(q)
+                return hit[1]
+            del _MEM[q]
+
     path = _cache_key(q)
-    if os.path.exists(path):
-        age = time.time() - os.path.getmtime(path)
-        if age < 3600:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-    return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if now - st.st_mtime >= SEARCH_CACHE_TTL:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    _mem_put(q, st.st_mtime, data)
+    return data
 
 
 def cache_set(q: str, data: Dict):
     path = _cache_key(q)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # Write to a private temp file and swap it in, so concurrent readers never see a partial file.
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(data))
+    os.replace(tmp, path)
+    _mem_put(q, time.time(), data)
+
+
+# ---------- Response cache (exact + semantic) for finished Gemini analyses ----------
+RESP_CACHE_DIR = os.path.join(CACHE_DIR, "resp")
+RESP_CACHE_TTL = 24 * 3600  # analyses are reused for a day
+SEMANTIC_THRESHOLD = 0.92  # min cosine similarity for a near-duplicate query to count as a hit
+EMBED_MODEL = "models/text-embedding-004"
+
+
+def is_error_response(text: str) -> bool:
+    # _call_gemini reports every failure (safety block, token limit, API error) as "(...)"
+    return not text or (text.startswith("(") and text.endswith(")"))
+
+
+class ResponseCache:
+    """
+    Caches final analyses keyed on (model, temperature, search flag, normalized query).
+    Misses fall back to a linear cosine scan over the embeddings of previously cached queries.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = RESP_CACHE_DIR,
+                 ttl: float = RESP_CACHE_TTL, threshold: float = SEMANTIC_THRESHOLD):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.threshold = threshold
+        self._vectors_path = os.path.join(cache_dir, "index.npy")
+        self._meta_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self._index_mtime = None
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._meta: List[Dict] = []
+
+    def _scope(self, temperature: float, use_search: bool) -> str:
+        return f"{self.model_name}|{temperature}|{use_search}"
+
+    def _key(self, query: str, temperature: float, use_search: bool) -> str:
+        raw = f"{self._scope(temperature, use_search)}|{query.strip().lower()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_entry(self, key: str) -> Optional[str]:
+        try:
+            with open(self._entry_path(key), "rb") as f:
+                entry = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created_at", 0) >= self.ttl:
+            return None
+        return entry.get("response")
+
+    def _refresh_index(self):
+        # Other workers append to the index too, so reload whenever the file on disk changes.
+        try:
+            mtime = os.stat(self._meta_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self._meta_path, "rb") as f:
+                meta = orjson.loads(f.read())
+            vectors = np.load(self._vectors_path)
+        except (OSError, ValueError):
+            return
+        if len(meta) != len(vectors):
+            return  # caught mid-write by another process; pick it up next time
+        self._meta, self._vectors, self._index_mtime = meta, vectors, mtime
+
+    def _save_index(self):
+        tmp_vectors = f"{self._vectors_path}.{os.getpid()}.tmp"
+        tmp_meta = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, self._vectors)
+        with open(tmp_meta, "wb") as f:
+            f.write(orjson.dumps(self._meta))
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_meta, self._meta_path)
+        self._index_mtime = os.stat(self._meta_path).st_mtime
+
+    def get(self, query: str, temperature: float, use_search: bool) -> Optional[str]:
+        return self._read_entry(self._key(query, temperature, use_search))
+
+    def get_similar(self, embedding: Optional[np.ndarray], temperature: float, use_search: bool) -> Optional[str]:
+        if embedding is None:
+            return None
+        scope = self._scope(temperature, use_search)
+        now = time.time()
+        with self._lock:
+            self._refresh_index()
+            if not self._meta or self._vectors.shape[1] != embedding.shape[0]:
+                return None
+            # Vectors are stored unit-normalized, so the dot product is the cosine similarity.
+            sims = self._vectors @ embedding
+            key = None
+            for i in np.argsort(-sims):
+                if sims[i] <= self.threshold:
+                    break
+                m = self._meta[i]
+                if m["scope"] == scope and now - m["created_at"] < self.ttl:
+                    key = m["key"]
+                    break
+        if key is None:
+            return None
+        return self._read_entry(key)
+
+    def set(self, query: str, temperature: float, use_search: bool, response: str,
+            embedding: Optional[np.ndarray] = None):
+        key = self._key(query, temperature, use_search)
+        now = time.time()
+        path = self._entry_path(key)
+        # Swap the entry in atomically so other workers never read a partial file (and re-pay Gemini).
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps({"query": query, "response": response, "created_at": now}))
+        os.replace(tmp, path)
+        if embedding is None:
+            return
+        with self._lock:
+            self._refresh_index()
+            keep = [i for i, m in enumerate(self._meta) if m["key"] != key and now - m["created_at"] < self.ttl]
+            meta = [self._meta[i] for i in keep]
+            vectors = self._vectors[keep] if keep else np.zeros((0, embedding.shape[0]), dtype=np.float32)
+            if vectors.shape[1] != embedding.shape[0]:
+                meta, vectors = [], np.zeros((0, embedding.shape[0]), dtype=np.float32)
+            meta.append({"key": key, "scope": self._scope(temperature, use_search), "created_at": now})
+            self._meta = meta
+            self._vectors = np.vstack([vectors, embedding[None, :]])
+            self._save_index()
 
 
 # ---------- Google Custom Search function ----------
+SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+
+# One pooled, keep-alive session for every worker thread, so repeat searches skip the TCP+TLS handshake.
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504)),
+))
+
+
 def fetch_search_results(query: str, num: int = SEARCH_RESULTS) -> List[Dict]:
     """
     Uses Google Custom Search JSON API to fetch recent results.
@@ -52,50 +244,147 @@ def fetch_search_results(query: str, num: int = SEARCH_RESULTS) -> List[Dict]:
     if cached:
         return cached["items"]
 
-    url = "https://www.googleapis.com/customsearch/v1"
     params = {"key": GOOGLE_API_KEY, "cx": GOOGLE_CX, "q": query, "num": min(num, 10)}
-    resp = requests.get(url, params=params, timeout=15)
+    resp = _HTTP.get(SEARCH_URL, params=params, timeout=15)
     resp.raise_for_status()
     data = resp.json()
     items = []
     for it in data.get("items", []):
-        items.append({
+        item = {
             "title": it.get("title"), "snippet": it.get("snippet"),
-            "link": it.get("link"), "raw": it
-        })
+            "link": it.get("link"), "displayLink": it.get("displayLink")
+        }
+        if DEBUG_RAW:
+            item["raw"] = it
+        items.append(item)
     cache_set(query, {"items": items, "fetched_at": time.time()})
     return items
 
 
+def _clip(s: Optional[str], n: int) -> str:
+    return s[:n] if s else ""
+
+
+def build_context_from_search(search_items: List[Dict]) -> str:
+    lines = []
+    for i, it in enumerate(search_items, start=1):
+        title = _clip(it.get("title"), 200)
+        snippet = _clip(it.get("snippet"), 400)
+        link = it.get("link") or ""
+        lines.append(f"[{i}] {title}\nSnippet: {snippet}\nURL: {link}\n")
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=512)
+def _grounding_for(query: str, window: int) -> Tuple[int, str]:
+    # `window` is the current SEARCH_CACHE_TTL slot, so memoized grounding goes stale with the file cache.
+    # Failed searches raise and are therefore never memoized.
+    search_items = fetch_search_results(query)
+    return len(search_items), build_context_from_search(search_items)
+
+
+def grounding_for(query: str) -> Tuple[int, str]:
+    """
+    Returns (number of sources, grounding text) for a query, memoized in-process.
+    """
+    return _grounding_for(query, int(time.time() // SEARCH_CACHE_TTL))
+
+
 # ---------- Gemini Agent ----------
 class GeminiAgent:
     def __init__(self, gemini_api_key: str, system_prompt: str):
         if not gemini_api_key or "PASTE" in gemini_api_key:
             raise ValueError("GEMINI_API_KEY missing. Please add it to the script.")
+        # Imported here rather than at module top: the SDK drags in protobuf/grpc/google-auth,
+        # which code paths that never build an agent (e.g. the search helpers) don't need.
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+        self._genai = genai
+        self._api_errors = google_exceptions
         genai.configure(api_key=gemini_api_key)
         self.system_prompt = system_prompt
         self.model_name = "gemini-2.5-flash"
+        self.temperature = 0.1
+        # Built once and reused; the system prompt rides along as system_instruction on every call.
+        self._model = self._genai.GenerativeModel(model_name=self.model_name, system_instruction=self.system_prompt)
+        # Server-side cached copy of the system prompt, created lazily on the first call (see _get_model).
+        self._ctx = None
+        self._ctx_model = None
+        self._ctx_expires = 0.0
+        self._ctx_refreshing = False
+        self._ctx_disabled = False
+        self._ctx_lock = threading.Lock()
+        self.cache = ResponseCache(self.model_name)
         print("Stratosphere initialized.")
 
-    def build_context_from_search(self, search_items: List[Dict]) -> str:
-        lines = []
-        for i, it in enumerate(search_items, start=1):
-            title = (it.get("title") or "")[:200]
-            snippet = (it.get("snippet") or "")[:400]
-            link = it.get("link") or ""
-            lines.append(f"[{i}] {title}\nSnippet: {snippet}\nURL: {link}\n")
-        return "\n".join(lines)
-
-    def _call_gemini(self, user_message: str, temperature: float = 0.1, max_tokens: int = 4048) -> str:
+    def _embed_query(self, query: str) -> Optional[np.ndarray]:
         try:
-            model = genai.GenerativeModel(model_name=self.model_name)
-            response = model.generate_content(
-                [self.system_prompt, user_message],
-                generation_config={
-                    "temperature": temperature,
-                    "max_output_tokens": max_tokens,
-                }
+            result = self._genai.embed_content(model=EMBED_MODEL, content=query.strip(), task_type="retrieval_query")
+        except Exception as e:
+            print(f"-> WARNING: Query embedding failed, semantic cache skipped: {e}")
+            return None
+        vec = np.asarray(result["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def _get_model(self):
+        """
+        Returns a model bound to a Gemini context cache holding the system prompt, so each request
+        only ships the user message. Falls back to the plain model if the cache can't be created;
+        if the API rejects the prompt outright (e.g. below the minimum cacheable size), caching
+        is switched off for the life of the agent.
+        """
+        with self._ctx_lock:
+            if self._ctx_disabled or self._ctx_refreshing or time.time() < self._ctx_expires:
+                return self._ctx_model or self._model
+            # This thread refreshes; the others keep using the current model instead of waiting on the network.
+            self._ctx_refreshing = True
+
+        ctx = ctx_model = None
+        expires = time.time() + CONTEXT_CACHE_RETRY
+        disabled = False
+        try:
+            ctx = self._genai.caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                system_instruction=self.system_prompt,
+                ttl=CONTEXT_CACHE_TTL,
             )
+            ctx_model = self._genai.GenerativeModel.from_cached_content(ctx)
+            # Refresh a minute early so in-flight requests never reference an expired cache.
+            expires = time.time() + CONTEXT_CACHE_TTL.total_seconds() - 60
+        except self._api_errors.InvalidArgument as e:
+            print(f"-> WARNING: Context caching rejected for this prompt, sending it inline from now on: {e}")
+            disabled = True
+        except Exception as e:
+            print(f"-> WARNING: Context caching unavailable, sending the system prompt inline: {e}")
+
+        with self._ctx_lock:
+            self._ctx, self._ctx_model = ctx, ctx_model
+            self._ctx_expires = expires
+            self._ctx_disabled = disabled
+            self._ctx_refreshing = False
+        return ctx_model or self._model
+
+    def _reset_context_cache(self):
+        with self._ctx_lock:
+            self._ctx = self._ctx_model = None
+            self._ctx_expires = 0.0
+
+    def _call_gemini(self, user_message: str, temperature: float = 0.1, max_tokens: int = MAX_OUTPUT_TOKENS,
+                     response_mime_type: Optional[str] = None) -> str:
+        try:
+            generation_config = {
+                "temperature": temperature,
+                "max_output_tokens": max_tokens,
+            }
+            if response_mime_type:
+                generation_config["response_mime_type"] = response_mime_type
+            try:
+                response = self._get_model().generate_content(user_message, generation_config=generation_config)
+            except self._api_errors.NotFound:
+                # The cached context was evicted server-side before our TTL ran out; recreate and retry once.
+                self._reset_context_cache()
+                response = self._get_model().generate_content(user_message, generation_config=generation_config)
             
             if not response.candidates:
                 return "(The API returned no candidates. This may be due to a temporary issue.)"
@@ -125,33 +414,194 @@ class GeminiAgent:
         except Exception as e:
             return f"(Error calling Gemini API: {e})"
 
-    def ask_market(self, query: str, use_search: bool = True) -> str:
-        grounding = ""
-        if use_search:
-            try:
-                print(f"-> Searching for: '{query}'...")
-                search_items = fetch_search_results(query)
-                if search_items:
-                    print(f"-> Found {len(search_items)} sources.")
-                    grounding = self.build_context_from_search(search_items)
-                else:
-                    print("-> WARNING: No search results were found.")
-                    grounding = "(No search results found.)"
-            except Exception as e:
-                print(f"-> ERROR: The search request failed: {e}")
-                grounding = f"(Warning: search failed. Analysis will use general knowledge.)"
-
-        user_message = (
-            f"User query: {query}\n\n"
-            "Use the following RECENT NEWS SNIPPETS as grounding:\n"
-            f"{grounding}\n\n"
-            "Follow the output format in the system instruction. If sources are insufficient, say so."
-        )
+    def _search_grounding(self, query: str) -> Tuple[str, bool]:
+        # Returns (grounding text, search succeeded). Answers built on a failed search must not be
+        # cached as grounded ones, so callers check the flag before cache.set.
+        try:
+            print(f"-> Searching for: '{query}'...")
+            count, grounding = grounding_for(query)
+        except Exception as e:
+            print(f"-> ERROR: The search request failed: {e}")
+            return f"(Warning: search failed. Analysis will use general knowledge.)", False
+        if count:
+            print(f"-> Found {count} sources.")
+            return grounding, True
+        print("-> WARNING: No search results were found.")
+        return "(No search results found.)", True
+
+    async def _search_grounding_async(self, query: str) -> Tuple[str, bool]:
+        return await asyncio.to_thread(self._search_grounding, query)
+
+    async def _embed_and_ground(self, query: str, use_search: bool) -> Tuple[Optional[np.ndarray], str, bool]:
+        # The query embedding (for the semantic cache) and the search are independent round-trips.
+        # Returns (embedding, grounding, cacheable); cacheable is False when the search failed.
+        embed = asyncio.to_thread(self._embed_query, query)
+        if not use_search:
+            return await embed, "", True
+        embedding, (grounding, search_ok) = await asyncio.gather(embed, self._search_grounding_async(query))
+        return embedding, grounding, search_ok
+
+    async def ask_market_async(self, query: str, use_search: bool = True) -> str:
+        cached = self.cache.get(query, self.temperature, use_search)
+        if cached:
+            print("-> Returning cached analysis.")
+            return cached
+
+        embedding, grounding, cacheable = await self._embed_and_ground(query, use_search)
+        cached = self.cache.get_similar(embedding, self.temperature, use_search)
+        if cached:
+            print("-> Returning cached analysis for a similar query.")
+            return cached
+
+        user_message = USER_TMPL.format(q=query, g=grounding)
         
         print("-> Asking Gemini for analysis...")
-        response_text = self._call_gemini(user_message)
+        response_text = await asyncio.to_thread(self._call_gemini, user_message, self.temperature)
+        if cacheable and not is_error_response(response_text):
+            self.cache.set(query, self.temperature, use_search, response_text, embedding)
         return response_text
 
+    def ask_market(self, query: str, use_search: bool = True) -> str:
+        return asyncio.run(self.ask_market_async(query, use_search))
+
+    def ask_market_stream(self, query: str, use_search: bool = True) -> Iterator[str]:
+        """
+        Yields the analysis text as Gemini generates it. Cached analyses are yielded in one piece.
+        """
+        cached = self.cache.get(query, self.temperature, use_search)
+        if cached:
+            print("-> Returning cached analysis.")
+            yield cached
+            return
+
+        embedding, grounding, cacheable = asyncio.run(self._embed_and_ground(query, use_search))
+        cached = self.cache.get_similar(embedding, self.temperature, use_search)
+        if cached:
+            print("-> Returning cached analysis for a similar query.")
+            yield cached
+            return
+
+        user_message = USER_TMPL.format(q=query, g=grounding)
+        generation_config = {"temperature": self.temperature, "max_output_tokens": MAX_OUTPUT_TOKENS}
+
+        print("-> Streaming Gemini analysis...")
+        parts = []
+        try:
+            try:
+                response = self._get_model().generate_content(
+                    user_message, generation_config=generation_config, stream=True)
+            except self._api_errors.NotFound:
+                self._reset_context_cache()
+                response = self._get_model().generate_content(
+                    user_message, generation_config=generation_config, stream=True)
+            for chunk in response:
+                if chunk.candidates and chunk.candidates[0].content.parts:
+                    parts.append(chunk.text)
+                    yield chunk.text
+        except Exception as e:
+            yield f"(Error calling Gemini API: {e})"
+            return
+
+        if not response.candidates:
+            yield "(The API returned no candidates. This may be due to a temporary issue.)"
+            return
+        finish_name = response.candidates[0].finish_reason.name
+        if not parts:
+            yield f"(Generation finished with reason: {finish_name}. No text was generated.)"
+            return
+        if finish_name in ("SAFETY", "RECITATION", "MAX_OUTPUT_TOKENS"):
+            # Partial output is shown but never cached
+            yield f"\n(Generation stopped early: {finish_name}.)"
+            return
+        response_text = "".join(parts).strip()
+        if cacheable and response_text:
+            self.cache.set(query, self.temperature, use_search, response_text, embedding)
+
+    def prefetch_searches(self, queries: List[str], use_search: bool = True):
+        """
+        Runs the CSE lookups for queries without a cached analysis concurrently, so a following
+        loop of (rate-limited, serialized) ask_market calls finds its grounding already memoized.
+        """
+        if not use_search:
+            return
+        pending = [q for q in dict.fromkeys(queries) if not self.cache.get(q, self.temperature, use_search)]
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(pending))) as pool:
+                list(pool.map(self._search_grounding, pending))
+
+    def ask_market_many(self, queries: List[str], use_search: bool = True) -> List[Dict[str, str]]:
+        """
+        Analyzes several queries with one fused Gemini request; the searches run concurrently.
+        Returns [{"query": ..., "analysis": ...}] in input order, duplicates removed.
+        """
+        results = {}
+        pending = []
+        for q in dict.fromkeys(queries):
+            cached = self.cache.get(q, self.temperature, use_search)
+            if cached:
+                results[q] = cached
+            else:
+                pending.append(q)
+
+        if pending:
+            if use_search:
+                with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(pending))) as pool:
+                    searched = list(pool.map(self._search_grounding, pending))
+            else:
+                searched = [("", True)] * len(pending)
+            groundings = [g for g, _ in searched]
+            cacheable = [ok for _, ok in searched]
+
+            blocks = "\n\n".join(
+                BATCH_ITEM_TMPL.format(i=i, q=q, g=g)
+                for i, (q, g) in enumerate(zip(pending, groundings), start=1)
+            )
+            user_message = BATCH_TMPL.format(blocks=blocks)
+
+            print(f"-> Asking Gemini for a batch analysis of {len(pending)} queries...")
+            response_text = self._call_gemini(
+                user_message, temperature=self.temperature,
+                max_tokens=min(MAX_OUTPUT_TOKENS * len(pending), 32768), response_mime_type="application/json"
+            )
+            results.update(self._split_batch_response(pending, response_text, use_search, cacheable))
+
+        return [{"query": q, "analysis": results[q]} for q in dict.fromkeys(queries)]
+
+    def _split_batch_response(self, queries: List[str], response_text: str, use_search: bool,
+                              cacheable: List[bool]) -> Dict[str, str]:
+        if is_error_response(response_text):
+            return {q: response_text for q in queries}
+        try:
+            entries = json.loads(response_text)
+        except ValueError as e:
+            return {q: f"(Could not parse the batch response from Gemini: {e})" for q in queries}
+        if not isinstance(entries, list):
+            return {q: "(Could not parse the batch response from Gemini: expected a JSON array.)" for q in queries}
+
+        # Keep only well-formed entries; a null or structured "analysis" must never reach the cache.
+        by_ticker = {}
+        for e in entries:
+            if not isinstance(e, dict) or not isinstance(e.get("analysis"), str):
+                continue
+            try:
+                ticker = int(e.get("ticker"))
+            except (TypeError, ValueError):
+                continue
+            analysis = e["analysis"].strip()
+            if analysis:
+                by_ticker[ticker] = analysis
+
+        results = {}
+        for i, (q, ok) in enumerate(zip(queries, cacheable), start=1):
+            analysis = by_ticker.get(i)
+            if analysis:
+                if ok:
+                    self.cache.set(q, self.temperature, use_search, analysis)
+                results[q] = analysis
+            else:
+                results[q] = "(The batch response contained no analysis for this query.)"
+        return results
+
 # ... (System Prompt remains the same) ...
 SYSTEM_PROMPT = """
 You are Stratosphere, a world-class, MBA-level Market Analyst assistant.
@@ -172,6 +622,24 @@ Output Format (Strict Adherence Required):
 Tone: Highly Professional, Concise, and Insightful.
 """
 
+# Per-request user messages; only the placeholders change between calls.
+USER_TMPL = (
+    "User query: {q}\n\n"
+    "Use the following RECENT NEWS SNIPPETS as grounding:\n"
+    "{g}\n\n"
+    "Follow the output format in the system instruction. If sources are insufficient, say so."
+)
+
+BATCH_ITEM_TMPL = "[Ticker {i}] User query: {q}\nGrounding:\n{g}"
+BATCH_TMPL = (
+    "Produce a separate analysis for EACH numbered query below, following the output format "
+    "in the system instruction. Ground each analysis only in the snippets listed under its own "
+    "[Ticker i] block. If sources are insufficient, say so.\n"
+    'Respond with a JSON array of objects {{"ticker": <i>, "analysis": "<full analysis text>"}}, '
+    "one per query, in order.\n\n"
+    "{blocks}"
+)
+
 # ---------- CLI ----------
 def main_cli():
     # Check for keys at the start
@@ -183,6 +651,7 @@ def main_cli():
 
     print("\nEnter a company name to analyze (e.g., 'Apple' or 'NVIDIA stock').")
     print("Add '--no-search' to a query to skip real-time search (e.g., 'Apple --no-search').")
+    print("Separate several companies with ';' to analyze them in one go (e.g., 'Apple; NVIDIA; AMD').")
     print("Type 'exit' to quit.")
 
     while True:
@@ -199,11 +668,19 @@ def main_cli():
             q = q_raw
 
         # Basic heuristic: if query short, add "recent news about"
-        query_string = f"recent news about {q}" if len(q.split()) <= 4 else q
-        
-        out = agent.ask_market(query_string, use_search=use_search)
-        print("\nAgent response:\n")
-        print(out)
+        query_strings = [
+            f"recent news about {part}" if len(part.split()) <= 4 else part
+            for part in (p.strip() for p in q.split(";")) if part
+        ]
+
+        # Searches for all companies run concurrently; the Gemini calls below stay one at a time.
+        if len(query_strings) > 1:
+            agent.prefetch_searches(query_strings, use_search=use_search)
+
+        for query_string in query_strings:
+            out = agent.ask_market(query_string, use_search=use_search)
+            print(f"\nAgent response ({query_string}):\n" if len(query_strings) > 1 else "\nAgent response:\n")
+            print(out)
 
 if __name__ == "__main__":
     main_cli()
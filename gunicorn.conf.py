@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+
+# ask_market blocks on network I/O (Google CSE + Gemini), so threaded workers let
+# slow requests overlap instead of queueing behind each other.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# A full grounded analysis can take well over 30s (Gunicorn's default timeout).
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth from the genai/protobuf caches;
+# the jitter keeps them from all restarting at once.
+max_requests = 500
+max_requests_jitter = 50
+
+# Import the app (and the Gemini SDK) once in the master and fork workers from it.
+# Safe because nothing opens a network connection at import: the genai client and the
+# context cache are created on first use, inside each worker.
+preload_app = True
+
+# No access log by default (stdout contention under load); set GUNICORN_ACCESS_LOG=- to enable.
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG")
+
+
+def post_worker_init(worker):
+    # Only the first worker warms the caches (see WARMUP_QUERIES in app.py); the others,
+    # and workers respawned later, pick the results up from the shared on-disk cache.
+    if worker.age == 1:
+        from app import start_warmup
+        start_warmup()